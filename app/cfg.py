@@ -28,14 +28,27 @@ MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral-large-latest")
 MISTRAL_OCR_MODEL = os.getenv("MISTRAL_OCR_MODEL", "mistral-ocr-latest")
 MISTRAL_BASEURL = os.getenv("MISTRAL_BASEURL")
+# At least one request has to be allowed, a zero-sized slot pool would block every Mistral call
+MISTRAL_MAX_INFLIGHT = max(1, int(os.getenv("MISTRAL_MAX_INFLIGHT", "4")))
+MISTRAL_RPS = float(os.getenv("MISTRAL_RPS", "0"))
+OCR_PAGES_PER_REQUEST = int(os.getenv("OCR_PAGES_PER_REQUEST", "20"))
+# OCR results shorter than this many characters are treated as garbage without asking the LLM
+MIN_OCR_CONTENT_CHARS = int(os.getenv("MIN_OCR_CONTENT_CHARS", "10"))
+# Directory for cached OCR results and verification verdicts, caching is disabled when empty
+OCR_CACHE_DIR = os.path.expanduser(os.getenv("OCR_CACHE_DIR", ""))
 
 PAPERLESS_URL = os.getenv("PAPERLESS_URL", "http://localhost:8000")
 PAPERLESS_API_KEY = os.getenv("PAPERLESS_API_KEY")
 TIMEOUT = int(os.getenv("TIMEOUT", "10"))
 USE_PAPERLESS_OCR = os.getenv("USE_PAPERLESS_OCR", "false").lower() == "true"
+CONCURRENCY = max(1, int(os.getenv("CONCURRENCY", "8")))
+DOWNLOAD_WORKERS = max(1, int(os.getenv("DOWNLOAD_WORKERS", "4")))
+# Gzip large document updates, needs a Paperless setup that decodes compressed request bodies
+COMPRESS_REQUESTS = os.getenv("COMPRESS_REQUESTS", "false").lower() == "true"
 
 # Custom field tracking configuration
 TRACK_PROCESSED = os.getenv("TRACK_PROCESSED", "true").lower() == "true"
 PROCESSED_FIELD_ID = int(os.getenv("PROCESSED_FIELD_ID", "3"))
 PROCESSED_FIELD_NAME = os.getenv("PROCESSED_FIELD_NAME", "mistral_processed")
 REPROCESS_DOCUMENTS = os.getenv("REPROCESS_DOCUMENTS", "false").lower() == "true"
+FIELD_ID_CACHE_FILE = os.path.expanduser(os.getenv("FIELD_ID_CACHE_FILE", "~/.cache/paperless-mistral-ocr/field_id.json"))
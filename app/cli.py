@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 import argparse
+import collections
+import functools
 import logging
-import os
-import shutil
+import queue
 import sys
+import tempfile
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
-import requests
 from cfg import (
+    CONCURRENCY,
+    DOWNLOAD_WORKERS,
     MISTRAL_API_KEY,
     MISTRAL_MODEL,
     MISTRAL_OCR_MODEL,
@@ -20,106 +25,142 @@ from cfg import (
     TRACK_PROCESSED,
     USE_PAPERLESS_OCR,
 )
+from helpers import get_session, json_dumps
 from main import (
-    ensure_custom_field_exists,
+    check_document_processed,
+    download_document,
     get_document_custom_fields,
     get_single_document,
     make_request,
     process_single_document,
+    resolve_processed_field_id,
     set_auth_tokens,
 )
 
+# Number of document list pages fetched concurrently
+PAGE_FETCH_WORKERS = 8
 
-def get_all_documents(sess, paperless_url, advanced_filter=None):
-    url = paperless_url + "/api/documents/"
+
+def iter_all_documents(sess, paperless_url, advanced_filter=None):
+    """
+    Retrieve the first page of documents and return the total count with an iterator over all documents.
+    The remaining pages are fetched while the iterator is consumed, so processing can start after the first page.
+    Returns (0, None) when the first page can't be retrieved.
+    """
+    base_url = paperless_url + "/api/documents/"
+    url = base_url
     if advanced_filter:
         url += f"?{advanced_filter}"
     response = make_request(sess, url, "GET")
     if not response or not isinstance(response, dict):
         logging.error("could not retrieve documents")
-        return []
+        return 0, None
+
+    total_count = response.get("count", 0)
+    logging.info("Found %s total documents", total_count)
+    return total_count, iter_document_pages(sess, base_url, response)
+
 
+def iter_document_pages(sess, base_url, response):
     documents = response.get("results", [])
     total_count = response.get("count", 0)
-    logging.info(f"Found {total_count} total documents, retrieving all pages")
+    yield from documents
+
+    if not response.get("next"):
+        return
+
+    all_ids = response.get("all")
+    page_size = len(documents)
+    if not all_ids or not page_size:
+        # Can't predict the remaining pages, follow the "next" links instead
+        yield from iter_remaining_pages_sequential(sess, response, page_size, total_count)
+        return
+
+    # Paperless lists every matching ID on the first page. Request the remaining documents by ID rather than by
+    # page number: documents are updated while later pages are still being fetched, and with the processed filter
+    # that shifts page offsets and would skip documents.
+    first_page_ids = {doc["id"] for doc in documents}
+    remaining_ids = [str(doc_id) for doc_id in all_ids if doc_id not in first_page_ids]
+    id_chunks = [remaining_ids[i : i + page_size] for i in range(0, len(remaining_ids), page_size)]
+    page_urls = [f"{base_url}?id__in={','.join(chunk)}&page_size={len(chunk)}" for chunk in id_chunks]
+    logging.info("Retrieving %s remaining pages", len(page_urls))
+
+    retrieved = page_size
+    for response in fetch_pages_concurrently(sess, page_urls):
+        if not response or not isinstance(response, dict):
+            logging.error("could not retrieve documents, stopping after %s documents", retrieved)
+            return
+
+        results = response.get("results", [])
+        retrieved += len(results)
+        logging.info("Retrieved %s/%s documents", retrieved, total_count)
+        yield from results
+
 
+def fetch_pages_concurrently(sess, page_urls):
+    """Fetch pages in parallel and yield them in order, keeping only a bounded number of pages in flight"""
+    with ThreadPoolExecutor(max_workers=PAGE_FETCH_WORKERS) as executor:
+        pending = collections.deque()
+        for page_url in page_urls:
+            pending.append(executor.submit(make_request, sess, page_url, "GET"))
+            if len(pending) >= 2 * PAGE_FETCH_WORKERS:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_remaining_pages_sequential(sess, response, retrieved, total_count):
     page = 1
     while response["next"]:
         page += 1
-        logging.info(f"Retrieving page {page}")
+        logging.info("Retrieving page %s", page)
         response = make_request(sess, response["next"], "GET")
         if not response or not isinstance(response, dict):
-            logging.error("could not retrieve documents")
-            return []
-
-        documents.extend(response.get("results", []))
-        logging.info(f"Retrieved {len(documents)}/{total_count} documents")
+            logging.error("could not retrieve documents, stopping after %s documents", retrieved)
+            return
 
-    return documents
-
-
-def download_document(sess, doc_id, paperless_url, temp_dir):
-    download_url = f"{paperless_url}/api/documents/{doc_id}/download/"
-    logging.info(f"Downloading document {doc_id}")
-
-    doc_source_path = None
-    try:
-        # Get a streaming response - this returns a requests Response object directly
-        response = make_request(sess, download_url, "GET", stream=True)
-
-        # Check if we got a valid response object
-        if response and isinstance(response, requests.Response):
-            # Create a temporary file to store the document
-            os.makedirs(temp_dir, exist_ok=True)
-            doc_source_path = os.path.join(temp_dir, f"document_{doc_id}.pdf")
-
-            with open(doc_source_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-            logging.info(f"Document downloaded to {doc_source_path}")
-            return doc_source_path
-        else:
-            logging.error(f"Could not download document {doc_id} - invalid response type")
-            return None
-    except Exception as e:
-        logging.error(f"Error downloading document {doc_id}: {e}")
-        # Clean up if download failed
-        if doc_source_path and os.path.exists(doc_source_path):
-            try:
-                os.remove(doc_source_path)
-            except:
-                pass
-        return None
+        results = response.get("results", [])
+        retrieved += len(results)
+        logging.info("Retrieved %s/%s documents", retrieved, total_count)
+        yield from results
 
 
 def run_single_document(args):
     if args.dry:
         logging.info("Running in dry mode")
-    logging.info(f"Running for document {args.document_id}")
-
-    # Create a temporary directory for this run
-    temp_dir = os.path.join(os.getcwd(), "temp_docs")
-    os.makedirs(temp_dir, exist_ok=True)
+    logging.info("Running for document %s", args.document_id)
 
     try:
-        with requests.Session() as sess:
+        # The temporary directory removes the downloaded file when processing is done
+        with get_session() as sess, tempfile.TemporaryDirectory(prefix="pl_doc_") as temp_dir:
             set_auth_tokens(sess, args.paperlesskey)
 
-            # Handle custom field for tracking processed documents
-            if args.track_processed:
-                field_id = ensure_custom_field_exists(sess, args.paperlessurl, args.processed_field_name, args.processed_field_id)
-                if field_id and field_id != args.processed_field_id:
-                    logging.info(f"Custom field ID mismatch, using ID {field_id} instead of configured {args.processed_field_id}")
-                    args.processed_field_id = field_id
+            # Paperless has no endpoint returning metadata and file together, so run both requests at the same time.
+            # Only download the document when Mistral OCR needs the file, Paperless OCR uses the stored content
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                doc_info_future = executor.submit(get_single_document, sess, args.document_id, args.paperlessurl)
+                download_future = None
+                if not args.use_paperless_ocr:
+                    download_future = executor.submit(download_document, sess, args.document_id, args.paperlessurl, temp_dir)
+
+                # Handle custom field for tracking processed documents while the document requests are running
+                if args.track_processed:
+                    field_id = resolve_processed_field_id(sess, args.paperlessurl, args.processed_field_name, args.processed_field_id)
+                    if field_id and field_id != args.processed_field_id:
+                        logging.info("Custom field ID mismatch, using ID %s instead of configured %s", field_id, args.processed_field_id)
+                        args.processed_field_id = field_id
+
+                doc_info = doc_info_future.result()
+                doc_source_path = download_future.result() if download_future else None
 
-            doc_info = get_single_document(sess, args.document_id, args.paperlessurl)
             if not isinstance(doc_info, dict):
-                logging.error(f"could not retrieve document info for document {args.document_id}")
+                logging.error("could not retrieve document info for document %s", args.document_id)
                 return
 
-            # Download the document
-            doc_source_path = download_document(sess, args.document_id, args.paperlessurl, temp_dir)
+            if args.track_processed and not args.reprocess:
+                if check_document_processed(get_document_custom_fields(doc_info), args.processed_field_id):
+                    logging.info("Document %s has already been processed, skipping (use --reprocess to force reprocessing)", args.document_id)
+                    return
 
             process_single_document(
                 sess,
@@ -130,36 +171,27 @@ def run_single_document(args):
                 args.mistralmodel,
                 args.mistralkey,
                 args.dry,
+                args.processed_field_id if args.track_processed else None,
             )
     except Exception as e:
-        logging.error(f"Error processing document {args.document_id}: {e}")
-    finally:
-        # Clean up temp directory after processing
-        if os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-                logging.debug(f"Cleaned up temporary directory: {temp_dir}")
-            except Exception as e:
-                logging.warning(f"Failed to clean up temporary directory {temp_dir}: {e}")
+        logging.error("Error processing document %s: %s", args.document_id, e)
 
 
-def process_document_with_retry(sess, doc, temp_dir, args, max_retries=3):
-    """Process a single document with retry logic"""
-    doc_id = doc["id"]
+def download_stage(sess, doc, args):
+    """Download a document into its own temporary directory, the processing stage cleans it up"""
+    temp_dir = tempfile.TemporaryDirectory(prefix="pl_doc_")
+    # Only download the document when Mistral OCR needs the file, Paperless OCR uses the stored content
+    doc_source_path = None if args.use_paperless_ocr else download_document(sess, doc["id"], args.paperlessurl, temp_dir.name)
+    return temp_dir, doc_source_path
+
 
-    # Skip if already processed and reprocessing is not enabled
-    if args.track_processed and not args.reprocess:
-        custom_fields = get_document_custom_fields(doc)
-        if args.processed_field_id in custom_fields and custom_fields[args.processed_field_id]:
-            logging.info(f"Document {doc_id} has already been processed, skipping (use --reprocess to force reprocessing)")
-            return True, True  # Skipped
+def process_document_with_retry(sess, doc, doc_source_path, args, max_retries=3):
+    """Process a single downloaded document with retry logic"""
+    doc_id = doc["id"]
 
     retries = 0
     while retries < max_retries:
         try:
-            # Download the document
-            doc_source_path = download_document(sess, doc_id, args.paperlessurl, temp_dir)
-
             success, skipped = process_single_document(
                 sess,
                 doc_id,
@@ -169,75 +201,147 @@ def process_document_with_retry(sess, doc, temp_dir, args, max_retries=3):
                 args.mistralmodel,
                 args.mistralkey,
                 args.dry,
+                args.processed_field_id if args.track_processed else None,
             )
             return success, skipped
         except Exception as e:
             retries += 1
-            logging.error(f"Error processing document {doc_id} (attempt {retries}/{max_retries}): {e}")
+            logging.error("Error processing document %s (attempt %s/%s): %s", doc_id, retries, max_retries, e)
             # Add a small delay before retrying
             time.sleep(2)
 
-    logging.error(f"Failed to process document {doc_id} after {max_retries} attempts")
+    logging.error("Failed to process document %s after %s attempts", doc_id, max_retries)
     return False, False
 
 
+def run_pipeline(sess, docs, args):
+    """
+    Download and process documents in two stages connected by bounded queues.
+    Downloads run ahead of processing so neither Paperless nor Mistral sits idle, the queue
+    size bounds how many downloaded documents wait on disk.
+    `docs` may be a lazy iterator, it is consumed by a feeder thread while earlier documents are processed.
+    Yields (doc_id, success, skipped) for every document as it finishes.
+    """
+    download_q = queue.Queue(maxsize=2 * args.concurrency)
+    process_q = queue.Queue(maxsize=2 * args.concurrency)
+    results_q = queue.Queue()
+
+    skip_processed = args.track_processed and not args.reprocess
+
+    def download_worker():
+        while True:
+            doc = download_q.get()
+            if doc is None:
+                return
+            if skip_processed and check_document_processed(get_document_custom_fields(doc), args.processed_field_id):
+                logging.info("Document %s has already been processed, skipping (use --reprocess to force reprocessing)", doc["id"])
+                results_q.put((doc["id"], True, True))
+                continue
+            try:
+                temp_dir, doc_source_path = download_stage(sess, doc, args)
+            except Exception as e:
+                logging.error("Error downloading document %s: %s", doc["id"], e)
+                results_q.put((doc["id"], False, False))
+                continue
+            process_q.put((doc, temp_dir, doc_source_path))
+
+    def process_worker():
+        while True:
+            item = process_q.get()
+            if item is None:
+                return
+            doc, temp_dir, doc_source_path = item
+            try:
+                success, skipped = process_document_with_retry(sess, doc, doc_source_path, args)
+            except Exception as e:
+                logging.error("Error processing document %s: %s", doc["id"], e)
+                success, skipped = False, False
+            finally:
+                temp_dir.cleanup()
+            results_q.put((doc["id"], success, skipped))
+
+    def feed():
+        try:
+            for doc in docs:
+                download_q.put(doc)
+        except Exception as e:
+            logging.error("Error retrieving documents: %s", e)
+        for _ in downloaders:
+            download_q.put(None)
+        # Processors stop once every download has been handed over
+        for thread in downloaders:
+            thread.join()
+        for _ in processors:
+            process_q.put(None)
+        for thread in processors:
+            thread.join()
+        results_q.put(None)
+
+    downloaders = [threading.Thread(target=download_worker, daemon=True) for _ in range(args.download_workers)]
+    processors = [threading.Thread(target=process_worker, daemon=True) for _ in range(args.concurrency)]
+    feeder = threading.Thread(target=feed, daemon=True)
+    for thread in downloaders + processors + [feeder]:
+        thread.start()
+
+    while True:
+        result = results_q.get()
+        if result is None:
+            break
+        yield result
+
+    feeder.join()
+
+
 def run_all_documents(args):
     if args.dry:
         logging.info("Running in dryrun mode")
 
     logging.info("Running on all documents")
 
-    # Create a temporary directory for this run
-    temp_dir = os.path.join(os.getcwd(), "temp_docs")
-    os.makedirs(temp_dir, exist_ok=True)
-
     try:
-        with requests.Session() as sess:
+        # One pooled session shared by all download and processing workers
+        with get_session(args.concurrency + args.download_workers) as sess:
             set_auth_tokens(sess, args.paperlesskey)
 
             # Handle custom field for tracking processed documents
             if args.track_processed:
-                field_id = ensure_custom_field_exists(sess, args.paperlessurl, args.processed_field_name, args.processed_field_id)
+                field_id = resolve_processed_field_id(sess, args.paperlessurl, args.processed_field_name, args.processed_field_id)
                 if field_id and field_id != args.processed_field_id:
-                    logging.info(f"Custom field ID mismatch, using ID {field_id} instead of configured {args.processed_field_id}")
+                    logging.info("Custom field ID mismatch, using ID %s instead of configured %s", field_id, args.processed_field_id)
                     args.processed_field_id = field_id
 
-            all_docs = get_all_documents(sess, args.paperlessurl, args.filterstr)
-            if not all_docs or not isinstance(all_docs, list):
+            advanced_filter = args.filterstr
+            if args.track_processed and not args.reprocess:
+                # Let Paperless leave out documents whose processed field is set. Documents without the field or with an
+                # empty value are still listed, matching check_document_processed which only counts a set value
+                field_id = args.processed_field_id
+                processed_query = json_dumps(["OR", [[field_id, "exists", False], [field_id, "isnull", True]]])
+                processed_filter = f"custom_field_query={quote(processed_query)}"
+                advanced_filter = f"{advanced_filter}&{processed_filter}" if advanced_filter else processed_filter
+
+            total_docs, all_docs = iter_all_documents(sess, args.paperlessurl, advanced_filter)
+            if all_docs is None:
                 logging.error("could not retrieve documents")
                 return
 
-            total_docs = len(all_docs)
-            logging.info(f"found {total_docs} documents")
+            logging.info("found %s documents", total_docs)
 
             # Filter excluded documents
             if args.exclude:
-                all_docs = [doc for doc in all_docs if doc["id"] not in args.exclude]
-                logging.info(f"Filtered to {len(all_docs)} documents after exclusions")
+                exclude_ids = frozenset(args.exclude)
+                all_docs = (doc for doc in all_docs if doc["id"] not in exclude_ids)
+                logging.info("Excluding %s document IDs", len(exclude_ids))
 
             # Process documents with progress tracking
             success_count = 0
             failed_count = 0
             skipped_count = 0
-            
-            docs_to_process = []
-            for doc in all_docs:
-                # Pre-flight skip check
-                if args.track_processed and not args.reprocess:
-                    custom_fields = get_document_custom_fields(doc)
-                    if args.processed_field_id in custom_fields and custom_fields[args.processed_field_id]:
-                        skipped_count += 1
-                        continue
-                docs_to_process.append(doc)
-
-            logging.info(f"Processing {len(docs_to_process)} documents ({skipped_count} documents were already processed and skipped)")
-
-            for i, doc in enumerate(docs_to_process, 1):
-                doc_id = doc["id"]
-                
-                logging.info(f"Processing document {i}/{len(docs_to_process)} (ID: {doc_id})")
-                success, skipped = process_document_with_retry(sess, doc, temp_dir, args)
+            finished_count = 0
 
+            # Documents are I/O-bound (download, Mistral API, upload), so overlap them across a download/process pipeline.
+            # Pages are still being retrieved while the first documents are processed.
+            for i, (doc_id, success, skipped) in enumerate(run_pipeline(sess, all_docs, args), 1):
+                finished_count = i
                 if skipped:
                     skipped_count += 1
                 elif success:
@@ -245,38 +349,35 @@ def run_all_documents(args):
                 else:
                     failed_count += 1
 
+                logging.debug("Finished document %s/%s (ID: %s)", i, total_docs, doc_id)
+
                 # Log progress periodically
-                if i % 10 == 0 or i == len(docs_to_process):
+                if i % 10 == 0:
                     logging.info(
-                        f"Progress: {i}/{len(docs_to_process)} documents processed ({success_count} success, {failed_count} failed, {skipped_count} total skipped)"
+                        "Progress: %s/%s documents processed (%s success, %s failed, %s total skipped)",
+                        i,
+                        total_docs,
+                        success_count,
+                        failed_count,
+                        skipped_count,
                     )
 
-                # Clean up temporary files periodically to avoid filling disk
-                if i % 20 == 0:
-                    try:
-                        for f in os.listdir(temp_dir):
-                            file_path = os.path.join(temp_dir, f)
-                            if os.path.isfile(file_path):
-                                os.remove(file_path)
-                        logging.debug("Cleaned temporary files")
-                    except Exception as e:
-                        logging.warning(f"Failed to clean temporary files: {e}")
-
-            logging.info(f"Completed processing {len(docs_to_process)} documents")
-            logging.info(f"Results: {success_count} successful, {failed_count} failed, {skipped_count} skipped")
+            logging.info("Completed processing %s documents", finished_count)
+            logging.info("Results: %s successful, %s failed, %s skipped", success_count, failed_count, skipped_count)
     except Exception as e:
-        logging.error(f"Error during batch processing: {e}")
-    finally:
-        # Clean up temp directory after processing
-        if os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-                logging.debug(f"Cleaned up temporary directory: {temp_dir}")
-            except Exception as e:
-                logging.warning(f"Failed to clean up temporary directory {temp_dir}: {e}")
+        logging.error("Error during batch processing: %s", e)
 
 
-def parse_args(args):
+def positive_int(value):
+    """argparse type for worker counts, which have to be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+@functools.lru_cache(maxsize=1)
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-l",
@@ -313,12 +414,19 @@ def parse_args(args):
     parser_all = subparsers.add_parser("all", description="Run on all documents")
     parser_all.add_argument("--exclude", action="append", type=int, help="Document ID to skip")
     parser_all.add_argument("--filterstr", type=str, help="Pass in url query parameters to filter document filter request by")
+    parser_all.add_argument("--concurrency", type=positive_int, default=CONCURRENCY, help="Number of documents to process in parallel")
+    parser_all.add_argument("--download-workers", type=positive_int, default=DOWNLOAD_WORKERS, help="Number of documents to download in parallel")
     parser_all.set_defaults(func=run_all_documents)
 
     parser_single = subparsers.add_parser("single", description="Run on a single document")
     parser_single.add_argument("document_id", type=int)
     parser_single.set_defaults(func=run_single_document)
 
+    return parser
+
+
+def parse_args(args):
+    parser = build_parser()
     parsed_args = parser.parse_args(args)
 
     logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S", level=parsed_args.loglevel)
@@ -328,7 +436,7 @@ def parse_args(args):
     except AttributeError:
         parser.print_help()
     except Exception as e:
-        logging.critical(f"Unhandled exception: {e}", exc_info=True)
+        logging.critical("Unhandled exception: %s", e, exc_info=True)
         sys.exit(1)
 
 
@@ -1,5 +1,9 @@
+import gzip
+import inspect
 import json
 import logging
+import random
+import threading
 import time
 import traceback
 
@@ -8,15 +12,87 @@ from cfg import TIMEOUT
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(value) -> bytes:
+    """Serialize to JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode("utf-8")
+
+
+def json_loads(value):
+    """Parse JSON from str or bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# Randomize retry backoff so parallel workers don't retry in lockstep, backoff_jitter needs urllib3 >= 2.0
+_RETRY_JITTER = {"backoff_jitter": 0.5} if "backoff_jitter" in inspect.signature(Retry).parameters else {}
+TRANSIENT_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+TRANSIENT_ERROR_MESSAGES = ("rate limit", "overloaded", "upstream connect error", "service unavailable")
+_TRUE_VALUES = frozenset({"y", "yes", "on", "1", "true", "t"})
+_GZIP_HEADERS = {"Content-Encoding": "gzip"}
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 8192
+# Status codes of servers that may not decode a gzip request body, Django/DRF answers with a 400 parse error
+GZIP_REJECTED_STATUS_CODES = frozenset({400, 415})
+
 
 def strtobool(value: str) -> bool:
-    value = value.lower()
-    if value in ("y", "yes", "on", "1", "true", "t"):
+    return value.lower() in _TRUE_VALUES
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` of them start per second, shared by all threads."""
+
+    def __init__(self, rate):
+        self.min_interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.min_interval:
+            return
+        # Reserve the next free slot under the lock, then sleep outside of it
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def is_transient_error(error):
+    """Check whether an API error is worth retrying (rate limits, overloaded or unavailable upstream)."""
+    if getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES:
         return True
-    return False
+    message = str(error).lower()
+    return any(text in message for text in TRANSIENT_ERROR_MESSAGES)
+
+
+def retry_with_backoff(call, attempts=4, base=1.0, cap=30.0):
+    """Run `call`, retrying transient errors with jittered exponential backoff. Other errors are raised right away."""
+    for attempt in range(attempts):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient_error(e):
+                raise
+            delay = min(cap, base * 2**attempt) + random.uniform(0, base)
+            logging.warning(f"Transient API error (attempt {attempt + 1}/{attempts}), retrying in {delay:.1f} seconds: {e}")
+            time.sleep(delay)
 
 
-def create_retry_session(retries=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), session=None):
+def create_retry_session(
+    retries=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), session=None, pool_maxsize=20, pool_block=False
+):
     """Create a requests session with retry capabilities"""
     session = session or requests.Session()
     retry = Retry(
@@ -25,71 +101,87 @@ def create_retry_session(retries=3, backoff_factor=0.5, status_forcelist=(429, 5
         connect=retries,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
+        **_RETRY_JITTER,
+        # Also retry the PATCH/POST calls made against the Paperless API
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"PATCH", "POST"},
     )
-    adapter = HTTPAdapter(max_retries=retry, pool_connections=10, pool_maxsize=20)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=10, pool_maxsize=pool_maxsize, pool_block=pool_block)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
+    session._retry_mounted = True
     return session
 
 
-def make_request(sess, url, method, body=None, params=None, headers=None, stream=False, max_retries=3):
-    if body is not None:
-        body = json.dumps(body)
-    if headers is None:
-        headers = {}
+def get_session(concurrency=1):
+    """
+    Create a session whose connection pool fits `concurrency` parallel workers.
+    The pool blocks when exhausted so workers wait for a kept-alive connection instead of opening throwaway ones.
+    """
+    return create_retry_session(pool_maxsize=max(20, 2 * concurrency), pool_block=True)
 
-    headers["Content-Type"] = "application/json"
 
-    # Add retry capabilities to the session
-    sess = create_retry_session(retries=max_retries, session=sess)
+def make_request(sess, url, method, body=None, params=None, headers=None, stream=False, max_retries=3, compress=False, error_info=None):
+    # error_info, when given, is filled with the status code and body of an HTTP error response
+    # Only requests with a body need a Content-Type, reuse the shared header dict for those
+    if body is not None:
+        body = json_dumps(body)
+        headers = _JSON_HEADERS if headers is None else {**headers, **_JSON_HEADERS}
+    # Large bodies (e.g. OCR content) are gzipped when asked to, unless the server already refused a compressed body
+    gzip_body = compress and body is not None and len(body) > GZIP_MIN_BYTES and not getattr(sess, "_gzip_rejected", False)
+
+    # Mount the retrying adapter once per session, urllib3 handles retries and backoff from there on
+    if not getattr(sess, "_retry_mounted", False):
+        create_retry_session(retries=max_retries, session=sess)
+
+    try:
+        r = None
+        if gzip_body:
+            r = sess.request(
+                method,
+                headers={**headers, **_GZIP_HEADERS},
+                url=url,
+                params=params,
+                data=gzip.compress(body, compresslevel=1),
+                timeout=TIMEOUT,
+                verify=True,
+                stream=stream,
+            )
+            if r.status_code in GZIP_REJECTED_STATUS_CODES:
+                # Resend the body uncompressed, the response tells whether compression or the body itself was the problem
+                r = None
+        if r is None:
+            r = sess.request(method, headers=headers, url=url, params=params, data=body, timeout=TIMEOUT, verify=True, stream=stream)
+            if gzip_body and r.ok:
+                # Only the compressed body was refused, a real validation error fails both attempts and keeps compression on
+                logging.warning(f"{url} rejected a gzip compressed body, sending uncompressed bodies from now on")
+                sess._gzip_rejected = True
+        r.raise_for_status()
 
-    # Track request attempt
-    attempt = 0
-    last_error = None
+        if stream:
+            # For streaming responses, return the raw response object
+            # This preserves the .iter_content method for download functionality
+            return r
 
-    while attempt < max_retries:
-        attempt += 1
         try:
-            r = sess.request(method, headers=headers, url=url, params=params, data=body, timeout=TIMEOUT, verify=True, stream=stream)
-            r.raise_for_status()
-
-            if stream:
-                # For streaming responses, return the raw response object
-                # This preserves the .iter_content method for download functionality
-                return r
-
-            try:
-                # Try to parse as JSON
-                json_response = r.json()
-                return json_response
-            except ValueError:
-                # Not JSON, return text
-                return r.text
-
-        except requests.exceptions.ConnectionError as e:
-            logging.error(f"Error connecting to {url} (attempt {attempt}/{max_retries}): {e}")
-            last_error = e
-        except requests.exceptions.Timeout as e:
-            logging.error(f"Timeout calling {url} (attempt {attempt}/{max_retries}): {e}")
-            last_error = e
-        except requests.exceptions.HTTPError as e:
-            logging.error(f"Http error calling {url} (attempt {attempt}/{max_retries}): {e}")
-            logging.error(f"Response: {r.text}")
-            last_error = e
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error calling {url} (attempt {attempt}/{max_retries}): {e}")
-            last_error = e
-        except Exception as e:
-            logging.error(f"Unexpected error occurred during request to {url} (attempt {attempt}/{max_retries}): {e}")
-            last_error = e
-
-        # Only retry if we didn't reach max_retries yet
-        if attempt < max_retries:
-            # Add exponential backoff
-            sleep_time = 2 ** (attempt - 1)
-            logging.info(f"Retrying in {sleep_time} seconds...")
-            time.sleep(sleep_time)
-
-    # If we got here, all retries failed
-    logging.error(f"All {max_retries} requests to {url} failed. Last error: {last_error}")
+            # Try to parse as JSON
+            json_response = json_loads(r.content)
+            return json_response
+        except ValueError:
+            # Not JSON, return text
+            return r.text
+
+    except requests.exceptions.ConnectionError as e:
+        logging.error(f"Error connecting to {url}: {e}")
+    except requests.exceptions.Timeout as e:
+        logging.error(f"Timeout calling {url}: {e}")
+    except requests.exceptions.HTTPError as e:
+        logging.error(f"Http error calling {url}: {e}")
+        logging.error(f"Response: {r.text}")
+        if error_info is not None:
+            error_info.update(status_code=r.status_code, text=r.text)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error calling {url}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error occurred during request to {url}: {e}")
+
     return None
@@ -1,19 +1,45 @@
 #!/usr/bin/env python3
-import base64
+import contextlib
+import functools
+import hashlib
 import json
 import logging
+import mmap
 import os
+import re
 import shutil
 import sys
 import tempfile
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+
+# pybase64 is a SIMD-accelerated drop-in for the base64 module, fall back to the stdlib when it isn't installed
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# pypdf is only used to count PDF pages for splitting large documents, without it PDFs are OCRed in one request
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
 from cfg import (
+    COMPRESS_REQUESTS,
+    FIELD_ID_CACHE_FILE,
+    MIN_OCR_CONTENT_CHARS,
     MISTRAL_API_KEY,
     MISTRAL_BASEURL,
+    MISTRAL_MAX_INFLIGHT,
     MISTRAL_MODEL,
     MISTRAL_OCR_MODEL,
+    MISTRAL_RPS,
+    OCR_CACHE_DIR,
+    OCR_PAGES_PER_REQUEST,
     PAPERLESS_API_KEY,
     PAPERLESS_URL,
     PROCESSED_FIELD_ID,
@@ -24,86 +50,205 @@ from cfg import (
     TRACK_PROCESSED,
     USE_PAPERLESS_OCR,
 )
-from helpers import make_request, strtobool
-from mistralai import Mistral
+from helpers import RateLimiter, get_session, json_dumps, json_loads, make_request, retry_with_backoff, strtobool
+
+# Shared by all worker threads so parallel documents stay within the Mistral account limits
+MISTRAL_SEMAPHORE = threading.BoundedSemaphore(MISTRAL_MAX_INFLIGHT)
+MISTRAL_RATE_LIMITER = RateLimiter(MISTRAL_RPS)
+# The system prompt is the same for every document, build its message once
+VERIFICATION_SYSTEM_MESSAGE = {"role": "system", "content": PROMPT}
+# Number of OCR characters sent to the LLM for verification
+VERIFICATION_CONTEXT_CHARS = 6000
+HORIZONTAL_WHITESPACE_RE = re.compile(r"[ \t]+")
+BLANK_LINES_RE = re.compile(r"\n\s*\n")
+BASE64_CHUNK_SIZE = 57 * 4096
+# Image MIME subtypes by file extension, anything else is sent as JPEG
+IMAGE_FORMATS = {".png": "png", ".gif": "gif", ".jpg": "jpeg", ".jpeg": "jpeg"}
+# Block size used when writing downloaded documents to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Verification verdicts of this process by content hash, scans often share the same boilerplate text
+VERDICT_CACHE = {}
+
+
+def check_args(doc_pks):
+    required = (
+        ("PAPERLESS_API_KEY", PAPERLESS_API_KEY),
+        ("PAPERLESS_URL", PAPERLESS_URL),
+        ("MISTRAL_API_KEY", MISTRAL_API_KEY),
+        ("MISTRAL_MODEL", MISTRAL_MODEL),
+        ("DOCUMENT_ID or DOCUMENT_IDS", doc_pks),
+        ("PROMPT", PROMPT),
+        ("TIMEOUT", TIMEOUT),
+    )
+    # Report every missing setting at once instead of one per run
+    missing = [name for name, value in required if not value]
+    if missing:
+        logging.error(f"Missing {', '.join(missing)}")
+        sys.exit(1)
 
 
-def check_args(doc_pk):
-    if not PAPERLESS_API_KEY:
-        logging.error("Missing PAPERLESS_API_KEY")
-        sys.exit(1)
-    if not PAPERLESS_URL:
-        logging.error("Missing PAPERLESS_URL")
-        sys.exit(1)
-    if not MISTRAL_API_KEY:
-        logging.error("Missing MISTRAL_API_KEY")
-        sys.exit(1)
-    if not MISTRAL_MODEL:
-        logging.error("Missing MISTRAL_MODEL")
-        sys.exit(1)
-    if not doc_pk:
-        logging.error("Missing DOCUMENT_ID")
-        sys.exit(1)
-    if not PROMPT:
-        logging.error("Missing PROMPT")
-        sys.exit(1)
-    if not TIMEOUT:
-        logging.error("Missing TIMEOUT")
-        sys.exit(1)
+def ocr_cache_path(key, suffix):
+    return os.path.join(OCR_CACHE_DIR, key[:2], f"{key}{suffix}")
 
 
-def encode_file_to_base64(file_path):
-    """Encode a file to base64."""
-    with open(file_path, "rb") as file:
-        return base64.b64encode(file.read()).decode("utf-8")
+def load_ocr_cache(key, suffix):
+    """Return the cached text for a content hash, or None on a miss."""
+    try:
+        with open(ocr_cache_path(key, suffix), encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
 
 
-def perform_mistral_ocr(file_path, mistral_api_key):
-    """Perform OCR using Mistral AI's OCR capabilities."""
-    client = Mistral(api_key=mistral_api_key)
+def save_ocr_cache(key, suffix, text):
+    path = ocr_cache_path(key, suffix)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not write OCR cache entry {path}: {e}")
 
-    if not os.path.exists(file_path):
-        logging.error(f"File not found: {file_path}")
+
+def encode_base64(data):
+    """Encode a bytes-like object to base64, chunk by chunk so no second copy of the input is made."""
+    view = memoryview(data)
+    encoded = bytearray()
+    # The chunk size is a multiple of 3, so the encoded chunks concatenate without padding in between
+    for start in range(0, len(view), BASE64_CHUNK_SIZE):
+        encoded += base64.b64encode(view[start : start + BASE64_CHUNK_SIZE])
+    view.release()
+    return encoded.decode("ascii")
+
+
+@functools.lru_cache(maxsize=None)
+def get_mistral_client(api_key):
+    """Return a shared Mistral client per API key so its connection pool is reused across documents."""
+    # Imported lazily, the Mistral SDK is slow to import and not needed for --help or Paperless OCR runs
+    from mistralai import Mistral
+
+    return Mistral(api_key=api_key)
+
+
+@contextlib.contextmanager
+def mistral_slot():
+    """Hold one of the limited in-flight Mistral request slots, respecting the configured requests per second."""
+    with MISTRAL_SEMAPHORE:
+        MISTRAL_RATE_LIMITER.acquire()
+        yield
+
+
+def call_mistral(call):
+    """Run a Mistral API call in a request slot, retrying rate limits and upstream hiccups with backoff."""
+
+    def attempt():
+        with mistral_slot():
+            return call()
+
+    return retry_with_backoff(attempt)
+
+
+def count_pdf_pages(pdf_file):
+    """Return the number of pages of an open PDF file, or None if it can't be determined."""
+    if PdfReader is None:
         return None
+    try:
+        return len(PdfReader(pdf_file).pages)
+    except Exception as e:
+        logging.debug(f"Could not count pages of {pdf_file.name}: {e}")
+        return None
+
+
+def ocr_document_url(client, document_url, page_count):
+    """
+    OCR an uploaded document, splitting large documents into page ranges that are processed in parallel.
+    Returns the OCR pages in document order.
+    """
+    document = {"type": "document_url", "document_url": document_url}
+    if OCR_PAGES_PER_REQUEST <= 0 or not page_count or page_count <= OCR_PAGES_PER_REQUEST:
+        return call_mistral(lambda: client.ocr.process(model=MISTRAL_OCR_MODEL, document=document)).pages
+
+    page_ranges = [
+        list(range(start, min(start + OCR_PAGES_PER_REQUEST, page_count))) for start in range(0, page_count, OCR_PAGES_PER_REQUEST)
+    ]
+    logging.debug(f"Splitting OCR of {page_count} pages into {len(page_ranges)} requests")
+
+    def ocr_pages(pages):
+        # Each range is retried on its own, a throttled range doesn't fail the whole document
+        return call_mistral(lambda: client.ocr.process(model=MISTRAL_OCR_MODEL, document=document, pages=pages)).pages
+
+    # The Mistral slots still bound how many of these requests actually run at once
+    with ThreadPoolExecutor(max_workers=min(len(page_ranges), MISTRAL_MAX_INFLIGHT)) as executor:
+        return [page for pages in executor.map(ocr_pages, page_ranges) for page in pages]
+
+
+def perform_mistral_ocr(file_path, mistral_api_key):
+    """Perform OCR using Mistral AI's OCR capabilities."""
+    client = get_mistral_client(mistral_api_key)
 
     try:
-        # If file is a PDF
-        if file_path.lower().endswith(".pdf"):
-            # Upload the PDF file
-            uploaded_file = client.files.upload(
-                file={
-                    "file_name": os.path.basename(file_path),
-                    "content": open(file_path, "rb"),
-                },
-                purpose="ocr",  # type: ignore (https://github.com/mistralai/client-python/issues/196)
-            )
-            signed_url = client.files.get_signed_url(file_id=uploaded_file.id)
-            ocr_response = client.ocr.process(
-                model=MISTRAL_OCR_MODEL,
-                document={"type": "document_url", "document_url": signed_url.url},
-            )
-        # If file is an image
-        else:
-            logging.warning(f"Performing OCR on image file {file_path} (this is less tested and probably more error prone)")
-            base64_image = encode_file_to_base64(file_path)
+        extension = os.path.splitext(file_path)[1].lower()
+        # The file is opened and mapped once, hashing, page counting, uploading and encoding all read the same pages
+        with open(file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Unchanged files (e.g. during reprocessing sweeps) reuse the stored OCR result instead of paying for it again.
+            # The OCR model is part of the key, switching models must not keep returning the old model's markdown
+            file_hash = None
+            if OCR_CACHE_DIR:
+                digest = hashlib.sha256(f"{MISTRAL_OCR_MODEL}\0".encode("utf-8"))
+                digest.update(data)
+                file_hash = digest.hexdigest()
+            if file_hash:
+                cached_content = load_ocr_cache(file_hash, ".md")
+                if cached_content is not None:
+                    logging.info(f"Using cached OCR result for {file_path}")
+                    return cached_content
+
+            # If file is a PDF
+            if extension == ".pdf":
+                page_count = count_pdf_pages(file)
+
+                # Upload the PDF file
+                # The handle is closed as soon as the upload finishes, retries rewind it instead of reopening the file
+                def upload():
+                    file.seek(0)
+                    return client.files.upload(
+                        file={
+                            "file_name": os.path.basename(file_path),
+                            "content": file,
+                        },
+                        purpose="ocr",  # type: ignore (https://github.com/mistralai/client-python/issues/196)
+                    )
+
+                uploaded_file = call_mistral(upload)
+            # If file is an image
+            else:
+                logging.warning(f"Performing OCR on image file {file_path} (this is less tested and probably more error prone)")
+                base64_image = encode_base64(data)
 
+        if extension == ".pdf":
+            signed_url = call_mistral(lambda: client.files.get_signed_url(file_id=uploaded_file.id))
+            ocr_pages = ocr_document_url(client, signed_url.url, page_count)
+        else:
             # Detect image format for the correct MIME type
-            image_format = "jpeg"  # Default
-            if file_path.lower().endswith((".png")):
-                image_format = "png"
-            elif file_path.lower().endswith((".gif")):
-                image_format = "gif"
-
-            ocr_response = client.ocr.process(
-                model=MISTRAL_OCR_MODEL, document={"type": "image_url", "image_url": f"data:image/{image_format};base64,{base64_image}"}
+            image_format = IMAGE_FORMATS.get(extension, "jpeg")
+
+            ocr_response = call_mistral(
+                lambda: client.ocr.process(
+                    model=MISTRAL_OCR_MODEL, document={"type": "image_url", "image_url": f"data:image/{image_format};base64,{base64_image}"}
+                )
             )
+            ocr_pages = ocr_response.pages
 
         # Extract text content from all pages
-        text_content = ""
-        for page in ocr_response.pages:
-            text_content += page.markdown + "\n\n"
-
-        return text_content.strip()
+        text_content = "\n\n".join(page.markdown or "" for page in ocr_pages).strip()
+        if file_hash and text_content:
+            save_ocr_cache(file_hash, ".md", text_content)
+        return text_content
+    except FileNotFoundError:
+        logging.error(f"File not found: {file_path}")
+        return None
     except Exception as e:
         logging.error(f"Error performing OCR with Mistral: {e}")
         return None
@@ -111,40 +256,64 @@ def perform_mistral_ocr(file_path, mistral_api_key):
         # Attempt to clean up any uploaded files
         try:
             if "uploaded_file" in locals() and hasattr(uploaded_file, "id"):
-                client.files.delete(file_id=uploaded_file.id)
+                with mistral_slot():
+                    client.files.delete(file_id=uploaded_file.id)
                 logging.debug(f"Deleted temporary Mistral file: {uploaded_file.id}")
         except Exception as e:
             logging.warning(f"Failed to delete temporary Mistral file: {e}")
 
 
+def compact_whitespace(text):
+    """Collapse runs of spaces and blank lines (OCR table padding) while keeping the line structure."""
+    text = HORIZONTAL_WHITESPACE_RE.sub(" ", text)
+    return BLANK_LINES_RE.sub("\n\n", text)
+
+
 def verify_ocr_content(content, model, api_key):
     """
     Uses an LLM to verify if the OCR content is meaningful or garbage.
     Returns True if the content is garbage, False otherwise.
     """
-    client = Mistral(api_key=api_key)
-    # Use a truncated version of the content for verification to save tokens/time
-    context = content[:6000]
-
-    messages = [{"role": "system", "content": PROMPT}, {"role": "user", "content": context}]
+    client = get_mistral_client(api_key)
+    # Use a truncated version of the content for verification to save tokens/time. Whitespace is compacted first
+    # so that padding doesn't use up the budget, a larger window is scanned to fill it with actual text.
+    context = compact_whitespace(content[: 2 * VERIFICATION_CONTEXT_CHARS])[:VERIFICATION_CONTEXT_CHARS]
+
+    # The verdict only depends on the model, the prompt and the verified text
+    verdict_key = hashlib.sha256(f"{model}\0{PROMPT}\0{context}".encode("utf-8")).hexdigest()
+    if verdict_key in VERDICT_CACHE:
+        logging.debug("Reusing OCR verification verdict for identical content")
+        return VERDICT_CACHE[verdict_key]
+    if OCR_CACHE_DIR:
+        cached_verdict = load_ocr_cache(verdict_key, ".verdict")
+        if cached_verdict in ("true", "false"):
+            logging.debug("Using cached OCR verification verdict")
+            return cached_verdict == "true"
+
+    messages = [VERIFICATION_SYSTEM_MESSAGE, {"role": "user", "content": context}]
 
     try:
-        chat_response = client.chat.complete(model=model, messages=messages, response_format={"type": "json_object"}, max_tokens=50)
+        chat_response = call_mistral(
+            lambda: client.chat.complete(model=model, messages=messages, response_format={"type": "json_object"}, max_tokens=50)
+        )
 
         if not chat_response.choices:
             logging.error("No response from Mistral for OCR verification")
             return None
 
         response_content = chat_response.choices[0].message.content
-        data = json.loads(response_content)
+        data = json_loads(response_content)
 
         if "is_garbage" not in data or not isinstance(data["is_garbage"], bool):
             logging.error(f"Invalid JSON response from Mistral for verification: {response_content}")
             return None
 
+        VERDICT_CACHE[verdict_key] = data["is_garbage"]
+        if OCR_CACHE_DIR:
+            save_ocr_cache(verdict_key, ".verdict", "true" if data["is_garbage"] else "false")
         return data["is_garbage"]
 
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e:  # also raised by orjson, its JSONDecodeError subclasses this one
         logging.error(f"Error parsing JSON response from Mistral verification: {e}")
         return None
     except Exception as e:
@@ -156,14 +325,15 @@ def set_auth_tokens(session: requests.Session, api_key):
     session.headers.update({"Authorization": f"Token {api_key}"})
 
 
-def update_document_content(sess, doc_pk, content, paperless_url):
+def update_document(sess, doc_pk, paperless_url, error_info=None, **fields):
+    """Update several document fields with a single PATCH request, `error_info` receives the details of an HTTP error."""
     url = paperless_url + f"/api/documents/{doc_pk}/"
-    body = {"content": content}
-    resp = make_request(sess, url, "PATCH", body=body)
+    resp = make_request(sess, url, "PATCH", body=fields, compress=COMPRESS_REQUESTS, error_info=error_info)
     if not resp:
-        logging.error(f"could not update document {doc_pk} content")
-        return
-    logging.info(f"updated document {doc_pk} content")
+        logging.error(f"could not update document {doc_pk} ({', '.join(fields)})")
+        return False
+    logging.info(f"updated document {doc_pk} ({', '.join(fields)})")
+    return True
 
 
 def get_custom_fields(sess, paperless_url):
@@ -199,30 +369,71 @@ def ensure_custom_field_exists(sess, paperless_url, field_name, field_id):
         # Try to create the field
         return create_custom_field(sess, paperless_url, field_name)
 
-    # Check if our field exists by ID
-    for field in fields:
-        if field.get("id") == field_id:
-            logging.debug(f"Found existing custom field {field_name} with ID {field_id}")
-            return field_id
+    # Check if our field exists by ID, then by name
+    fields_by_id = {field.get("id"): field for field in fields}
+    if field_id in fields_by_id:
+        logging.debug(f"Found existing custom field {field_name} with ID {field_id}")
+        return field_id
 
-    # Check if our field exists by name
-    for field in fields:
-        if field.get("name") == field_name:
-            field_id = field.get("id")
-            logging.debug(f"Found existing custom field {field_name} with ID {field_id}")
-            return field_id
+    fields_by_name = {field.get("name"): field for field in fields}
+    if field_name in fields_by_name:
+        field_id = fields_by_name[field_name].get("id")
+        logging.debug(f"Found existing custom field {field_name} with ID {field_id}")
+        return field_id
 
     # Field doesn't exist, create it
     return create_custom_field(sess, paperless_url, field_name)
 
 
+def load_field_id_cache():
+    try:
+        with open(FIELD_ID_CACHE_FILE, "rb") as f:
+            cache = json_loads(f.read())
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_field_id_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(FIELD_ID_CACHE_FILE), exist_ok=True)
+        tmp_path = f"{FIELD_ID_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json_dumps(cache))
+        os.replace(tmp_path, FIELD_ID_CACHE_FILE)
+    except OSError as e:
+        logging.warning(f"Could not write custom field cache {FIELD_ID_CACHE_FILE}: {e}")
+
+
+def resolve_processed_field_id(sess, paperless_url, field_name, field_id):
+    """Resolve the processed custom field ID, using the on-disk cache to skip the custom field lookup."""
+    # The configured ID is part of the key, changing it must not keep returning an ID resolved for the old setting
+    cache_key = f"{paperless_url}|{field_name}|{field_id}"
+    cache = load_field_id_cache()
+    if cache_key in cache:
+        logging.debug(f"Using cached ID {cache[cache_key]} for custom field {field_name}")
+        return cache[cache_key]
+
+    resolved_id = ensure_custom_field_exists(sess, paperless_url, field_name, field_id)
+    if resolved_id:
+        cache[cache_key] = resolved_id
+        save_field_id_cache(cache)
+    return resolved_id
+
+
+def invalidate_cached_field_id(paperless_url, field_id):
+    """Forget a cached field ID that Paperless rejected, the next run looks it up again."""
+    cache = load_field_id_cache()
+    stale_keys = [key for key, value in cache.items() if key.startswith(f"{paperless_url}|") and value == field_id]
+    if stale_keys:
+        for key in stale_keys:
+            del cache[key]
+        save_field_id_cache(cache)
+
+
 def get_document_custom_fields(doc_info):
     """Extract custom fields from document info."""
-    custom_fields = {}
-    if "custom_fields" in doc_info:
-        for field in doc_info["custom_fields"]:
-            custom_fields[field["field"]] = field["value"]
-    return custom_fields
+    return {field["field"]: field["value"] for field in doc_info.get("custom_fields", [])}
 
 
 def check_document_processed(custom_fields, field_id):
@@ -237,59 +448,21 @@ def check_document_processed(custom_fields, field_id):
     return False
 
 
-def update_document_processed_status(sess, doc_pk, paperless_url, field_id):
-    """Update the custom field to indicate the document has been processed."""
-    # First, get the current document to retrieve existing custom fields
-    doc_info = get_single_document(sess, doc_pk, paperless_url)
-    if not isinstance(doc_info, dict):
-        logging.error(f"Could not retrieve document info for document {doc_pk}")
-        return False
+def build_processed_custom_fields(existing_custom_fields, field_id):
+    """Build the document's custom fields with the processed field set to the current timestamp."""
+    timestamp = int(time.time())
 
-    # Get existing custom fields
-    existing_custom_fields = doc_info.get("custom_fields", [])
-
-    # Check if our field already exists in the list
-    field_exists = False
-    timestamp = int(datetime.now().timestamp())
-
-    # Create a new list of custom fields, preserving existing ones
-    updated_custom_fields = []
-    for field in existing_custom_fields:
-        if field["field"] == field_id:
-            # Update the existing field
-            field_exists = True
-            updated_field = {"field": field_id, "value": timestamp}
-            updated_custom_fields.append(updated_field)
-        else:
-            # Preserve other fields
-            updated_custom_fields.append(field)
+    # Preserve existing fields in order, replacing our field's value or appending it if missing
+    fields_by_id = {field["field"]: field for field in existing_custom_fields}
+    fields_by_id[field_id] = {"field": field_id, "value": timestamp}
+    return list(fields_by_id.values())
 
-    # Add our field if it doesn't exist yet
-    if not field_exists:
-        updated_custom_fields.append({"field": field_id, "value": timestamp})
 
-    # Update the document with all custom fields
-    url = paperless_url + f"/api/documents/{doc_pk}/"
-    body = {"custom_fields": updated_custom_fields}
-    resp = make_request(sess, url, "PATCH", body=body)
-
-    if not resp:
-        logging.error(f"Could not update processed status for document {doc_pk}")
-        return False
-
-    logging.info(f"Updated processed status for document {doc_pk} with timestamp {timestamp}")
-    return True
-
-
-def process_single_document(sess, doc_pk, doc_source_path, doc_info, paperless_url, mistral_model, mistral_api_key, dry_run=False):
+def process_single_document(
+    sess, doc_pk, doc_source_path, doc_info, paperless_url, mistral_model, mistral_api_key, dry_run=False, processed_field_id=None
+):
+    """Process a fetched document, `processed_field_id` is the resolved tracking field or None when tracking is disabled."""
     try:
-        # If tracking is enabled, check if document has already been processed
-        if TRACK_PROCESSED and not REPROCESS_DOCUMENTS:
-            custom_fields = get_document_custom_fields(doc_info)
-            if check_document_processed(custom_fields, PROCESSED_FIELD_ID):
-                logging.info(f"Document {doc_pk} has already been processed, skipping (set REPROCESS_DOCUMENTS=true to reprocess)")
-                return False, True # Skipped
-
         ocr_content = None
         # If configured to use Mistral OCR, perform OCR on the document
         if not USE_PAPERLESS_OCR and doc_source_path:
@@ -307,40 +480,52 @@ def process_single_document(sess, doc_pk, doc_source_path, doc_info, paperless_u
             logging.warning(f"Document {doc_pk} has no content to process, skipping.")
             return False, True # Skipped
 
-        # Post-process OCR with LLM to check for garbage
-        is_garbage = verify_ocr_content(ocr_content, mistral_model, mistral_api_key)
+        # Content Paperless already has (always the case with Paperless OCR) needs neither verification nor an update
+        content_changed = ocr_content.strip() != (doc_info.get("content") or "").strip()
+        if not content_changed:
+            logging.info(f"OCR content for document {doc_pk} matches the existing content, skipping verification.")
+            is_garbage = False
+        elif len(ocr_content.strip()) < MIN_OCR_CONTENT_CHARS:
+            logging.info(f"OCR content for document {doc_pk} is shorter than {MIN_OCR_CONTENT_CHARS} characters, skipping verification.")
+            is_garbage = True
+        else:
+            # Post-process OCR with LLM to check for garbage
+            is_garbage = verify_ocr_content(ocr_content, mistral_model, mistral_api_key)
 
         if is_garbage is None:
             logging.error(f"Could not verify OCR content for document {doc_pk}. Skipping update.")
             return False, False # Failed
 
+        # Content and processed status are sent to Paperless in a single PATCH
+        patch = {}
         if is_garbage:
             logging.warning(f"OCR content for document {doc_pk} determined to be garbage. No changes will be made.")
-        else:
+        elif content_changed:
             logging.info(f"OCR content for document {doc_pk} is valid. Updating document.")
             if not dry_run:
-                update_document_content(sess, doc_pk, ocr_content, paperless_url)
+                patch["content"] = ocr_content
             else:
                 logging.info(f"DRY RUN: Would update document {doc_pk} with new OCR content.")
 
         # Update the processed status if tracking is enabled, regardless of garbage status
-        if not dry_run and TRACK_PROCESSED:
-            update_document_processed_status(sess, doc_pk, paperless_url, PROCESSED_FIELD_ID)
-        elif dry_run and TRACK_PROCESSED:
+        if not dry_run and processed_field_id:
+            # The caller already fetched the document, reuse its custom fields instead of requesting it again
+            patch["custom_fields"] = build_processed_custom_fields(doc_info.get("custom_fields", []), processed_field_id)
+        elif dry_run and processed_field_id:
             logging.info(f"DRY RUN: Would update processed status for document {doc_pk}")
 
+        error_info = {}
+        if patch and not update_document(sess, doc_pk, paperless_url, error_info=error_info, **patch):
+            # Only a rejected custom field means it may have been deleted in Paperless, don't keep trusting the cached ID then.
+            # Timeouts, server errors and content problems keep the cache
+            if error_info.get("status_code") == 400 and "custom_fields" in error_info.get("text", ""):
+                invalidate_cached_field_id(paperless_url, processed_field_id)
+            return False, False # Failed
+
         return True, False # Success
     except Exception as e:
         logging.error(f"Error processing document {doc_pk}: {e}")
         return False, False # Failed
-    finally:
-        # Clean up the temporary file if we created one
-        if doc_source_path and os.path.exists(doc_source_path) and "temp_docs" in doc_source_path:
-            try:
-                os.remove(doc_source_path)
-                logging.debug(f"Removed temporary file: {doc_source_path}")
-            except Exception as e:
-                logging.warning(f"Failed to remove temporary file {doc_source_path}: {e}")
 
 
 def get_single_document(sess, doc_pk, paperless_url):
@@ -348,38 +533,101 @@ def get_single_document(sess, doc_pk, paperless_url):
     return make_request(sess, url, "GET")
 
 
-def run_for_document(doc_pk):
-    check_args(doc_pk)
+def download_document(sess, doc_id, paperless_url, temp_dir):
+    download_url = f"{paperless_url}/api/documents/{doc_id}/download/"
+    logging.info(f"Downloading document {doc_id}")
 
-    with requests.Session() as sess:
-        set_auth_tokens(sess, PAPERLESS_API_KEY)
+    doc_source_path = None
+    try:
+        # Get a streaming response - this returns a requests Response object directly
+        response = make_request(sess, download_url, "GET", stream=True)
+
+        # Check if we got a valid response object
+        if response and isinstance(response, requests.Response):
+            # Create a temporary file to store the document
+            os.makedirs(temp_dir, exist_ok=True)
+            doc_source_path = os.path.join(temp_dir, f"document_{doc_id}.pdf")
+
+            # Let the raw stream undo any transfer encoding and copy it in 1 MiB blocks in C
+            response.raw.decode_content = True
+            with open(doc_source_path, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+
+            logging.info(f"Document downloaded to {doc_source_path}")
+            return doc_source_path
+        else:
+            logging.error(f"Could not download document {doc_id} - invalid response type")
+            return None
+    except Exception as e:
+        logging.error(f"Error downloading document {doc_id}: {e}")
+        # Clean up if download failed
+        if doc_source_path:
+            try:
+                os.remove(doc_source_path)
+            except OSError:
+                pass
+        return None
 
-        global PROCESSED_FIELD_ID
-        if TRACK_PROCESSED:
-            field_id = ensure_custom_field_exists(sess, PAPERLESS_URL, PROCESSED_FIELD_NAME, PROCESSED_FIELD_ID)
-            if field_id and field_id != PROCESSED_FIELD_ID:
-                logging.info(f"Custom field ID mismatch, using ID {field_id} instead of configured {PROCESSED_FIELD_ID}")
-                PROCESSED_FIELD_ID = field_id
 
-        doc_info = get_single_document(sess, doc_pk, PAPERLESS_URL)
-        if not isinstance(doc_info, dict):
-            logging.error(f"could not retrieve document info for document {doc_pk}")
+def run_fetched_document(sess, doc_pk, doc_info, doc_source_path, processed_field_id):
+    if not isinstance(doc_info, dict):
+        logging.error(f"could not retrieve document info for document {doc_pk}")
+        return
+
+    # If tracking is enabled, check if document has already been processed
+    if processed_field_id and not REPROCESS_DOCUMENTS:
+        if check_document_processed(get_document_custom_fields(doc_info), processed_field_id):
+            logging.info(f"Document {doc_pk} has already been processed, skipping (set REPROCESS_DOCUMENTS=true to reprocess)")
             return
 
-        doc_source_path = os.getenv("DOCUMENT_SOURCE_PATH", None)
+    if doc_source_path or USE_PAPERLESS_OCR:
+        process_single_document(
+            sess, doc_pk, doc_source_path, doc_info, PAPERLESS_URL, MISTRAL_MODEL, MISTRAL_API_KEY, DRY_RUN, processed_field_id
+        )
+        return
 
+    # Without a consumed file, Mistral OCR runs on the original downloaded from Paperless
+    with tempfile.TemporaryDirectory(prefix="pl_doc_") as temp_dir:
+        doc_source_path = download_document(sess, doc_pk, PAPERLESS_URL, temp_dir)
+        if not doc_source_path:
+            logging.error(f"Failed to download document {doc_pk}, skipping.")
+            return
         process_single_document(
-            sess,
-            doc_pk,
-            doc_source_path,
-            doc_info,
-            PAPERLESS_URL,
-            MISTRAL_MODEL,
-            MISTRAL_API_KEY,
-            DRY_RUN,
+            sess, doc_pk, doc_source_path, doc_info, PAPERLESS_URL, MISTRAL_MODEL, MISTRAL_API_KEY, DRY_RUN, processed_field_id
         )
 
 
+def run_for_documents(doc_pks, doc_source_path=None):
+    """
+    Process documents one after another in this process, sharing the Paperless session, the Mistral client
+    and the custom field lookup. `doc_source_path` is the consumed file of a single post-consume document.
+    """
+    check_args(doc_pks)
+
+    with get_session() as sess:
+        set_auth_tokens(sess, PAPERLESS_API_KEY)
+
+        processed_field_id = PROCESSED_FIELD_ID if TRACK_PROCESSED else None
+        # The custom field lookup doesn't depend on the document, fetch the first document while it runs
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            doc_info_future = executor.submit(get_single_document, sess, doc_pks[0], PAPERLESS_URL)
+            if TRACK_PROCESSED:
+                field_id = resolve_processed_field_id(sess, PAPERLESS_URL, PROCESSED_FIELD_NAME, PROCESSED_FIELD_ID)
+                if field_id and field_id != PROCESSED_FIELD_ID:
+                    logging.info(f"Custom field ID mismatch, using ID {field_id} instead of configured {PROCESSED_FIELD_ID}")
+                    processed_field_id = field_id
+            doc_info = doc_info_future.result()
+
+        for index, doc_pk in enumerate(doc_pks):
+            if index:
+                doc_info = get_single_document(sess, doc_pk, PAPERLESS_URL)
+            run_fetched_document(sess, doc_pk, doc_info, doc_source_path, processed_field_id)
+
+
+def run_for_document(doc_pk):
+    run_for_documents([doc_pk] if doc_pk else [], os.getenv("DOCUMENT_SOURCE_PATH", None))
+
+
 if __name__ == "__main__":
     LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
     logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S", level=LOGLEVEL)
@@ -387,14 +635,9 @@ if __name__ == "__main__":
     if DRY_RUN:
         logging.info("DRY_RUN ENABLED")
 
-    # Ensure temp directory exists but is clean
-    temp_dir = os.path.join(os.getcwd(), "temp_docs")
-    if os.path.exists(temp_dir):
-        try:
-            shutil.rmtree(temp_dir)
-            logging.debug(f"Cleaned up temporary directory: {temp_dir}")
-        except Exception as e:
-            logging.warning(f"Failed to clean up temporary directory {temp_dir}: {e}")
-    os.makedirs(temp_dir, exist_ok=True)
-
-    run_for_document(os.getenv("DOCUMENT_ID"))
+    # DOCUMENT_IDS (comma separated) processes several documents in one run, e.g. for backfills
+    doc_ids = os.getenv("DOCUMENT_IDS")
+    if doc_ids:
+        run_for_documents([doc_id.strip() for doc_id in doc_ids.split(",") if doc_id.strip()])
+    else:
+        run_for_document(os.getenv("DOCUMENT_ID"))
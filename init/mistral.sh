@@ -1,3 +1,3 @@
 #!/usr/bin/env bash
 
-pip3 install mistralai==1.6.0 requests==2.32.3 python-dotenv==1.1.0
+pip3 install mistralai==1.6.0 requests==2.32.3 python-dotenv==1.1.0 orjson==3.10.18 pybase64==1.4.1 pypdf==5.4.0